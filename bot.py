@@ -1,5 +1,6 @@
 from telegram import Update
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     MessageHandler,
     CommandHandler,
@@ -7,28 +8,44 @@ from telegram.ext import (
     filters
 )
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 import asyncio
 import logging
 import sys
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # === Configuration ===
 import os
 TOKEN = os.getenv("BOT_TOKEN")
 MAX_REPORT_VIDEOS = 10  # Maximum videos to show in report
-RATE_LIMIT_DELAY = 0.5  # Delay between sending videos
 REPORT_COOLDOWN = 30  # Minimum seconds between /report commands per chat
 DELETE_COOLDOWN = 60  # Minimum seconds between /delete_duplicates commands per chat
+ADMIN_CACHE_TTL = 60  # Seconds to trust a cached admin-status lookup
+DELETE_CONCURRENCY = 20  # Maximum in-flight delete_message calls (paced by the limiter's overall bucket)
+CONCURRENT_UPDATES = 8  # Updates processed at once, so a slow /stats doesn't stall ingestion
+OPTIMIZE_INTERVAL = 3600  # Seconds between PRAGMA optimize runs
 
 # === Webhook Configuration ===
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Set this in Render environment variables
 PORT = int(os.getenv("PORT", 8080))  # Changed to 8080 for Render
 
 # === Rate limiting storage ===
-last_report_usage = {}
-last_delete_usage = {}
+RATE_LIMIT_CACHE_SIZE = 10_000  # Maximum chats remembered per cooldown map
+last_report_usage = OrderedDict()
+last_delete_usage = OrderedDict()
+admin_status_cache = OrderedDict()  # (chat_id, user_id) -> (checked_at, is_admin)
+
+def remember_usage(cache, key, value):
+    """Store value in an OrderedDict-backed LRU, evicting the oldest entry when full"""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > RATE_LIMIT_CACHE_SIZE:
+        cache.popitem(last=False)
 
 # === Logging setup ===
 logging.basicConfig(
@@ -42,32 +59,72 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # === Database context manager ===
+DB_PATH = "videos.db"
+_local = threading.local()
+
+def _open_connection():
+    """Open a new database connection with the bot's PRAGMAs applied"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    # WAL is persistent per database; the remaining PRAGMAs are per connection
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    return conn
+
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections"""
-    conn = None
+    """Context manager yielding this thread's persistent database connection"""
+    conn = getattr(_local, "conn", None)
     try:
-        conn = sqlite3.connect("videos.db", check_same_thread=False)
+        if conn is None:
+            conn = _open_connection()
+            _local.conn = conn
         yield conn
     except Exception as e:
-        logger.error(f"Database connection error: {e}")
+        logger.error("Database connection error: %s", e)
         raise
-    finally:
-        if conn:
-            conn.close()
+
+@contextmanager
+def db_transaction(immediate=False):
+    """Context manager running the enclosed statements in a single transaction"""
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
 
 # === Database setup ===
+def _analyze_if_unseeded(conn):
+    """Run ANALYZE once videos has rows but the planner has no statistics for it yet"""
+    if conn.execute("SELECT 1 FROM videos LIMIT 1").fetchone() is None:
+        return
+    # ANALYZE on empty tables creates sqlite_stat1 without a row for videos
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None:
+        if conn.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl = 'videos'").fetchone() is not None:
+            return
+    conn.execute("ANALYZE")
+    logger.info("Gathered initial planner statistics")
+
 def initialize_database():
     """Initialize database tables and indexes"""
-    with get_db_connection() as conn:
+    # Schema setup uses its own short-lived connection rather than the pool
+    conn = _open_connection()
+    try:
         cursor = conn.cursor()
 
+        # Run every schema step in one transaction so no insert can land mid-migration
+        cursor.execute("BEGIN IMMEDIATE")
+
         # Create videos table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS videos (
             file_unique_id TEXT,
             file_id TEXT,
-            count INTEGER,
             first_seen TEXT,
             chat_id INTEGER,
             message_id INTEGER,
@@ -75,6 +132,12 @@ def initialize_database():
         )
         """)
 
+        # Migrate older databases: the per-row count is derived via COUNT(*) now
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(videos)")}
+        if "count" in columns:
+            cursor.execute("ALTER TABLE videos DROP COLUMN count")
+            logger.info("Dropped redundant count column from videos table")
+
         # Create report_messages table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS report_messages (
@@ -86,18 +149,177 @@ def initialize_database():
         )
         """)
 
+        # Create dup_files table: per-video counts kept in sync by triggers on videos
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dup_files (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT,
+            count INTEGER NOT NULL
+        )
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS videos_ai AFTER INSERT ON videos
+        BEGIN
+            INSERT INTO dup_files (file_unique_id, file_id, count)
+            VALUES (NEW.file_unique_id, NEW.file_id, 1)
+            ON CONFLICT(file_unique_id) DO UPDATE SET count = count + 1;
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS videos_ad AFTER DELETE ON videos
+        BEGIN
+            UPDATE dup_files SET count = count - 1 WHERE file_unique_id = OLD.file_unique_id;
+            DELETE FROM dup_files WHERE file_unique_id = OLD.file_unique_id AND count <= 0;
+        END
+        """)
+
+        # Backfill dup_files once (schema version 1), rebuilding it from videos
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] < 1:
+            cursor.execute("DELETE FROM dup_files")
+            cursor.execute("""
+                INSERT INTO dup_files (file_unique_id, file_id, count)
+                SELECT file_unique_id, MIN(file_id), COUNT(*)
+                FROM videos
+                GROUP BY file_unique_id
+            """)
+            cursor.execute("PRAGMA user_version = 1")
+
         # Add indexes for better performance
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_unique_id ON videos(file_unique_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_chat_id ON videos(chat_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_chat_unique ON videos(chat_id, file_unique_id, message_id)")
+        # Redundant with the primary key / idx_videos_chat_unique; drop them on older databases
+        cursor.execute("DROP INDEX IF EXISTS idx_videos_unique_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_videos_chat_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_videos_unique_msg")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dup_files_count ON dup_files(count)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_report_messages_chat_id ON report_messages(chat_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_report_messages_type ON report_messages(report_type)")
 
+        # Gather planner statistics once there is data; the periodic optimize job keeps them fresh
+        _analyze_if_unseeded(conn)
+
         conn.commit()
         logger.info("Database initialized successfully")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 # Initialize database on startup
 initialize_database()
 
+# === Database queries (blocking; run via asyncio.to_thread) ===
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db")
+
+def _store_video(unique_id, file_id, chat_id, message_id, first_seen):
+    """Insert a video message, returning True if it was not already recorded"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Insert this message if not exist; RETURNING yields a row only when inserted
+        cursor.execute(
+            "INSERT OR IGNORE INTO videos (file_unique_id, file_id, first_seen, chat_id, message_id) "
+            "VALUES (?, ?, ?, ?, ?) RETURNING rowid",
+            (unique_id, file_id, first_seen, chat_id, message_id)
+        )
+        return cursor.fetchone() is not None
+
+def _fetch_report_rows():
+    """Return the number of repeated sets and the top MAX_REPORT_VIDEOS of them"""
+    # One read transaction, consistent snapshot
+    with db_transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM dup_files WHERE count > 1")
+        repeated_sets = cursor.fetchone()[0]
+
+        # Only the top MAX_REPORT_VIDEOS sets are shown, so limit in SQL
+        cursor.execute("""
+            SELECT file_unique_id, file_id, count
+            FROM dup_files
+            WHERE count > 1
+            ORDER BY count DESC
+            LIMIT ?
+        """, (MAX_REPORT_VIDEOS,))
+        return repeated_sets, cursor.fetchall()
+
+def _store_report_messages(messages_to_store):
+    """Record sent report messages for later cleanup, in one write transaction"""
+    with db_transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO report_messages (chat_id, message_id, report_type, created_at) VALUES (?, ?, ?, ?)",
+            messages_to_store
+        )
+
+def _fetch_report_message_ids(chat_id):
+    """Return the report message ids stored for a chat"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT message_id FROM report_messages WHERE chat_id = ?", (chat_id,))
+        return [message_id for (message_id,) in cursor.fetchall()]
+
+def _clear_report_messages(chat_id):
+    """Forget all stored report messages for a chat"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM report_messages WHERE chat_id = ?", (chat_id,))
+
+def _fetch_duplicate_rows(chat_id):
+    """Return every duplicate in a chat, skipping the first message_id per unique video"""
+    # The window pass streams off idx_videos_chat_unique, so only rows to delete come back
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT file_unique_id, message_id, chat_id
+            FROM (
+                SELECT file_unique_id, message_id, chat_id,
+                       ROW_NUMBER() OVER (PARTITION BY file_unique_id ORDER BY message_id) AS rn
+                FROM videos
+                WHERE chat_id = ?
+            )
+            WHERE rn > 1
+        """, (chat_id,))
+        return cursor.fetchall()
+
+def _delete_video_rows(videos_to_delete):
+    """Remove (file_unique_id, message_id) rows from videos in one write transaction"""
+    with db_transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "DELETE FROM videos WHERE file_unique_id = ? AND message_id = ?",
+            videos_to_delete
+        )
+
+def _optimize_database():
+    """Let SQLite refresh planner statistics where they have gone stale"""
+    with get_db_connection() as conn:
+        # A fresh deployment starts empty, so seed statistics once videos arrive
+        _analyze_if_unseeded(conn)
+        # 0x10000 checks every table, not just those this pooled connection has queried
+        # (SQLite >= 3.46; older versions ignore the bit)
+        conn.execute("PRAGMA optimize=0x10002")
+
+def _fetch_stats(chat_id):
+    """Return video statistics plus the stored report message count for a chat"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Derive every video statistic from the trigger-maintained per-video counts
+        cursor.execute("""
+            SELECT
+                COALESCE(SUM(count), 0),
+                COUNT(*),
+                COUNT(*) FILTER (WHERE count > 1),
+                COALESCE(SUM(count - 1) FILTER (WHERE count > 1), 0),
+                (SELECT MIN(first_seen) FROM videos)
+            FROM dup_files
+        """)
+        stats = cursor.fetchone()
+
+        # Get report messages count
+        cursor.execute("SELECT COUNT(*) FROM report_messages WHERE chat_id = ?", (chat_id,))
+        return (*stats, cursor.fetchone()[0])
+
 # === Video handler: store message info + count ===
 async def video_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -110,80 +332,55 @@ async def video_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         unique_id = video.file_unique_id
         chat_id = update.effective_chat.id
         message_id = update.message.message_id
+        first_seen = datetime.now(timezone.utc).isoformat()
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-
-            # Insert this message if not exist
-            cursor.execute(
-                "INSERT OR IGNORE INTO videos VALUES (?, ?, ?, ?, ?, ?)",
-                (unique_id, file_id, 0, datetime.now().isoformat(), chat_id, message_id)
-            )
-
-            # Count total appearances
-            cursor.execute(
-                "SELECT COUNT(*) FROM videos WHERE file_unique_id = ?",
-                (unique_id,)
-            )
-            result = cursor.fetchone()
-            if result:
-                total_for_file = result[0]
-            else:
-                total_for_file = 1
-
-            cursor.execute(
-                "UPDATE videos SET count = ? WHERE file_unique_id = ?",
-                (total_for_file, unique_id)
-            )
-
-            conn.commit()
+        inserted = await asyncio.to_thread(_store_video, unique_id, file_id, chat_id, message_id, first_seen)
 
-        logger.info(f"Processed video {unique_id} in chat {chat_id}, now appears {total_for_file} times")
+        if inserted:
+            logger.info("Processed video %s in chat %s", unique_id, chat_id)
+        else:
+            logger.info("Video %s in chat %s was already recorded", unique_id, chat_id)
 
     except Exception as e:
-        logger.error(f"Error processing video message: {e}")
+        logger.error("Error processing video message: %s", e)
         # Don't re-raise to prevent bot crashes
 
 # === /report command: shows duplicates with video links ===
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
-        current_time = datetime.now().timestamp()
+        current_time = time.monotonic()
 
         # Rate limiting check
-        if chat_id in last_report_usage:
-            time_diff = current_time - last_report_usage[chat_id]
+        last_used = last_report_usage.get(chat_id)
+        if last_used is not None:
+            time_diff = current_time - last_used
             if time_diff < REPORT_COOLDOWN:
                 remaining = int(REPORT_COOLDOWN - time_diff)
                 await update.message.reply_text(f"⏰ Please wait {remaining} seconds before using /report again.")
                 return
 
-        last_report_usage[chat_id] = current_time
-        logger.info(f"Report command called in chat {chat_id}")
+        remember_usage(last_report_usage, chat_id, current_time)
+        logger.info("Report command called in chat %s", chat_id)
 
         # How many unique repeated file_unique_id
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT file_unique_id, file_id, COUNT(*) AS total_count
-                FROM videos
-                GROUP BY file_unique_id
-                HAVING total_count > 1
-                ORDER BY total_count DESC
-            """)
-            repeated = cursor.fetchall()
+        repeated_sets, repeated = await asyncio.to_thread(_fetch_report_rows)
 
         if not repeated:
             await update.message.reply_text("No repeated videos found yet.")
             return
 
-        report_msg = await update.message.reply_text(f"📊 Duplicate Video Report\nTotal repeated sets: {len(repeated)}")
+        report_msg = await update.message.reply_text(f"📊 Duplicate Video Report\nTotal repeated sets: {repeated_sets}")
+
+        # Every message stored for this report shares one timestamp
+        created_at = datetime.now(timezone.utc).isoformat()
 
-        # Send each repeated video (first MAX_REPORT_VIDEOS)
+        # Send each repeated video (first MAX_REPORT_VIDEOS) in rank order;
+        # the application's rate limiter handles Telegram's pacing and RetryAfter
         videos_sent = 0
-        messages_to_store = [(chat_id, report_msg.message_id, "header", datetime.now().isoformat())]
+        messages_to_store = [(chat_id, report_msg.message_id, "header", created_at)]
 
-        for i, (unique_id, file_id, total_count) in enumerate(repeated[:MAX_REPORT_VIDEOS], start=1):
+        for i, (unique_id, file_id, total_count) in enumerate(repeated, start=1):
             try:
                 sent_msg = await context.bot.send_video(
                     chat_id=chat_id,
@@ -191,30 +388,23 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     caption=f"{i}. Repeated {total_count} times"
                 )
                 # Store the video message for cleanup
-                messages_to_store.append((chat_id, sent_msg.message_id, "video", datetime.now().isoformat()))
+                messages_to_store.append((chat_id, sent_msg.message_id, "video", created_at))
                 videos_sent += 1
-                await asyncio.sleep(RATE_LIMIT_DELAY)  # slight delay to prevent timeouts
             except Exception as e:
-                logger.warning(f"Could not send video {i} ({unique_id}): {e}")
+                logger.warning("Could not send video %s (%s): %s", i, unique_id, e)
                 try:
                     error_msg = await update.message.reply_text(f"⚠️ Could not send video {i} (skipped).")
                     # Store error message for cleanup
-                    messages_to_store.append((chat_id, error_msg.message_id, "error", datetime.now().isoformat()))
+                    messages_to_store.append((chat_id, error_msg.message_id, "error", created_at))
                 except Exception as inner_e:
-                    logger.error(f"Could not send error message: {inner_e}")
+                    logger.error("Could not send error message: %s", inner_e)
 
         # Store all messages in database
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.executemany(
-                "INSERT INTO report_messages (chat_id, message_id, report_type, created_at) VALUES (?, ?, ?, ?)",
-                messages_to_store
-            )
-            conn.commit()
-        logger.info(f"Report completed: sent {videos_sent} videos in chat {chat_id}")
+        await asyncio.to_thread(_store_report_messages, messages_to_store)
+        logger.info("Report completed: sent %d videos in chat %s", videos_sent, chat_id)
 
     except Exception as e:
-        logger.error(f"Error in report command: {e}")
+        logger.error("Error in report command: %s", e)
         try:
             await update.message.reply_text("❌ An error occurred while generating the report.")
         except:
@@ -226,102 +416,93 @@ async def delete_duplicates(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat = update.effective_chat
         user = update.effective_user
         chat_id = update.effective_chat.id
-        current_time = datetime.now().timestamp()
+        current_time = time.monotonic()
+
+        # Check admin status first (cached briefly to skip repeated get_member calls),
+        # so a non-admin's attempt neither spends the chat's cooldown nor hits the API each time
+        cache_key = (chat_id, user.id)
+        cached = admin_status_cache.get(cache_key)
+        if cached is not None and current_time - cached[0] < ADMIN_CACHE_TTL:
+            is_admin = cached[1]
+        else:
+            try:
+                member = await chat.get_member(user.id)
+            except Exception as e:
+                logger.error("Could not check admin status: %s", e)
+                await update.message.reply_text("❌ Could not verify admin status")
+                return
+            is_admin = member.status in ["administrator", "creator"]
+            remember_usage(admin_status_cache, cache_key, (current_time, is_admin))
+
+        if not is_admin:
+            await update.message.reply_text("❌ Only admins can run this command")
+            return
 
         # Rate limiting check
-        if chat_id in last_delete_usage:
-            time_diff = current_time - last_delete_usage[chat_id]
+        last_used = last_delete_usage.get(chat_id)
+        if last_used is not None:
+            time_diff = current_time - last_used
             if time_diff < DELETE_COOLDOWN:
                 remaining = int(DELETE_COOLDOWN - time_diff)
                 await update.message.reply_text(f"⏰ Please wait {remaining} seconds before using /delete_duplicates again.")
                 return
 
-        last_delete_usage[chat_id] = current_time
-
-        # Check admin status
-        try:
-            member = await chat.get_member(user.id)
-            if member.status not in ["administrator", "creator"]:
-                await update.message.reply_text("❌ Only admins can run this command")
-                return
-        except Exception as e:
-            logger.error(f"Could not check admin status: {e}")
-            await update.message.reply_text("❌ Could not verify admin status")
-            return
+        remember_usage(last_delete_usage, chat_id, current_time)
 
         chat_id = update.effective_chat.id
         total_deleted = 0
-        logger.info(f"Delete duplicates command called by admin {user.id} in chat {chat_id}")
+        logger.info("Delete duplicates command called by admin %s in chat %s", user.id, chat_id)
 
         # Get report messages to delete
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT message_id FROM report_messages WHERE chat_id = ?", (chat_id,))
-            report_messages = cursor.fetchall()
+        report_messages = await asyncio.to_thread(_fetch_report_message_ids, chat_id)
 
-        report_deleted = 0
-        for (message_id,) in report_messages:
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                total_deleted += 1
-                report_deleted += 1
-            except Exception as e:
-                logger.warning(f"Could not delete report message {message_id}: {e}")
+        # Delete messages concurrently, bounded to stay under Telegram's rate limits
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete_message(target_chat_id, message_id, kind):
+            async with semaphore:
+                try:
+                    await context.bot.delete_message(chat_id=target_chat_id, message_id=message_id)
+                    return True
+                except Exception as e:
+                    logger.warning("Could not delete %s message %s: %s", kind, message_id, e)
+                    return False
+
+        results = await asyncio.gather(
+            *(delete_message(chat_id, message_id, "report") for message_id in report_messages)
+        )
+        report_deleted = sum(results)
+        total_deleted += report_deleted
 
         # Clear report messages from database
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM report_messages WHERE chat_id = ?", (chat_id,))
-            conn.commit()
-
-        # Find all duplicates (keep first message_id per unique video)
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT file_unique_id, message_id, chat_id
-                FROM videos
-                WHERE file_unique_id IN (
-                    SELECT file_unique_id
-                    FROM videos
-                    GROUP BY file_unique_id
-                    HAVING COUNT(*) > 1
-                )
-                ORDER BY file_unique_id, message_id
-            """)
-            rows = cursor.fetchall()
-
-        duplicates_deleted = 0
-        videos_to_delete = []
-        last_unique = None
-        for unique_id, message_id, video_chat_id in rows:
-            # Skip first occurrence
-            if unique_id != last_unique:
-                last_unique = unique_id
-                continue
-            try:
-                await context.bot.delete_message(chat_id=video_chat_id, message_id=message_id)
-                total_deleted += 1
-                duplicates_deleted += 1
-                videos_to_delete.append((unique_id, message_id))
-            except Exception as e:
-                logger.warning(f"Could not delete duplicate message {message_id}: {e}")
+        await asyncio.to_thread(_clear_report_messages, chat_id)
+
+        # Find all duplicates in this chat (keep first message_id per unique video)
+        duplicates = await asyncio.to_thread(_fetch_duplicate_rows, chat_id)
+
+        results = await asyncio.gather(
+            *(delete_message(video_chat_id, message_id, "duplicate")
+              for _, message_id, video_chat_id in duplicates)
+        )
+        videos_to_delete = [
+            (unique_id, message_id)
+            for (unique_id, message_id, _), deleted in zip(duplicates, results)
+            if deleted
+        ]
+        duplicates_deleted = len(videos_to_delete)
+        total_deleted += duplicates_deleted
 
         # Remove deleted videos from database
         if videos_to_delete:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    "DELETE FROM videos WHERE file_unique_id = ? AND message_id = ?",
-                    videos_to_delete
-                )
-                conn.commit()
-        logger.info(f"Delete duplicates completed: deleted {total_deleted} total messages "
-                   f"({report_deleted} reports, {duplicates_deleted} duplicates) in chat {chat_id}")
+            await asyncio.to_thread(_delete_video_rows, videos_to_delete)
+        logger.info("Delete duplicates completed: deleted %d total messages "
+                    "(%d reports, %d duplicates) in chat %s",
+                    total_deleted, report_deleted, duplicates_deleted, chat_id)
         await update.message.reply_text(f"✅ Deleted {total_deleted} messages "
                                       f"({report_deleted} reports, {duplicates_deleted} duplicates).")
 
     except Exception as e:
-        logger.error(f"Error in delete_duplicates command: {e}")
+        logger.error("Error in delete_duplicates command: %s", e)
         try:
             await update.message.reply_text("❌ An error occurred while deleting duplicates.")
         except:
@@ -332,45 +513,9 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-
-            # Get total videos processed
-            cursor.execute("SELECT COUNT(*) FROM videos")
-            total_videos = cursor.fetchone()[0]
-
-            # Get unique videos
-            cursor.execute("SELECT COUNT(DISTINCT file_unique_id) FROM videos")
-            unique_videos = cursor.fetchone()[0]
-
-            # Get duplicate sets
-            cursor.execute("""
-                SELECT COUNT(*) FROM (
-                    SELECT file_unique_id
-                    FROM videos
-                    GROUP BY file_unique_id
-                    HAVING COUNT(*) > 1
-                )
-            """)
-            duplicate_sets = cursor.fetchone()[0]
-
-            # Get total duplicates
-            cursor.execute("""
-                SELECT SUM(COUNT(*) - 1) FROM videos
-                GROUP BY file_unique_id
-                HAVING COUNT(*) > 1
-            """)
-            result = cursor.fetchone()
-            total_duplicates = result[0] if result and result[0] else 0
-
-            # Get report messages count
-            cursor.execute("SELECT COUNT(*) FROM report_messages WHERE chat_id = ?", (chat_id,))
-            report_messages = cursor.fetchone()[0]
-
-            # Get oldest video date
-            cursor.execute("SELECT MIN(first_seen) FROM videos")
-            oldest_result = cursor.fetchone()
-            oldest_date = oldest_result[0] if oldest_result and oldest_result[0] else "N/A"
+        (total_videos, unique_videos, duplicate_sets, total_duplicates,
+         oldest_date, report_messages) = await asyncio.to_thread(_fetch_stats, chat_id)
+        oldest_date = oldest_date or "N/A"
 
         stats_text = f"""📈 **Bot Statistics**
 
@@ -387,15 +532,41 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • /stats - Show this statistics"""
 
         await update.message.reply_text(stats_text, parse_mode='Markdown')
-        logger.info(f"Stats command used in chat {chat_id}")
+        logger.info("Stats command used in chat %s", chat_id)
 
     except Exception as e:
-        logger.error(f"Error in stats command: {e}")
+        logger.error("Error in stats command: %s", e)
         await update.message.reply_text("❌ Could not retrieve statistics.")
 
+# === Periodic maintenance ===
+async def optimize_database_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(_optimize_database)
+        logger.info("Ran PRAGMA optimize")
+    except Exception as e:
+        logger.error("Error optimizing database: %s", e)
+
+# === Rate limiter ===
+class SendRateLimiter(AIORateLimiter):
+    """AIORateLimiter that exempts housekeeping calls from the per-group bucket only"""
+
+    # Housekeeping calls that don't count toward Telegram's per-group message limit
+    UNGROUPED_ENDPOINTS = {"deleteMessage", "getChatMember"}
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in self.UNGROUPED_ENDPOINTS:
+            # data only selects the buckets; the callback still gets the real payload via args.
+            # A non-negative placeholder chat_id keeps the overall bucket but skips the group one.
+            data = dict(data, chat_id=0)
+        return await super().process_request(callback, args, kwargs, endpoint, data, rate_limit_args)
+
 # === Main function ===
-async def main():
-    """Main async function"""
+async def post_init(application):
+    """Route asyncio.to_thread DB work through a fixed pool of connection-holding threads"""
+    asyncio.get_running_loop().set_default_executor(DB_EXECUTOR)
+
+def main():
+    """Main entry point; PTB owns a single long-running event loop for all updates"""
     if not TOKEN:
         logger.error("BOT_TOKEN environment variable not set!")
         return
@@ -404,7 +575,20 @@ async def main():
     initialize_database()
 
     # Create application
-    application = ApplicationBuilder().token(TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .rate_limiter(SendRateLimiter(
+            overall_max_rate=25,
+            overall_time_period=1,
+            group_max_rate=18,
+            group_time_period=60,
+            max_retries=3
+        ))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .build()
+    )
 
     # Handlers
     application.add_handler(MessageHandler(filters.VIDEO, video_handler))
@@ -412,23 +596,25 @@ async def main():
     application.add_handler(CommandHandler("delete_duplicates", delete_duplicates))
     application.add_handler(CommandHandler("stats", stats_command))
 
+    # Jobs
+    application.job_queue.run_repeating(optimize_database_job, interval=OPTIMIZE_INTERVAL, first=OPTIMIZE_INTERVAL)
+
     if WEBHOOK_URL:
-        # Webhook mode for production
+        # Webhook mode for production: updates are pushed onto PTB's update queue
+        # and processed on the same loop, with no per-request thread or loop
         print("🤖 Starting webhook mode...")
         webhook_url = f"{WEBHOOK_URL}/webhook"
-        await application.run_webhook(
+        application.run_webhook(
             listen="0.0.0.0",
             port=PORT,
+            url_path="webhook",
             webhook_url=webhook_url,
             secret_token=None  # Optional: add for security
         )
     else:
         # Polling mode for local development
         print("🤖 Starting polling mode (local development)...")
-        await application.run_polling()
-
-if __name__ == "__main__":
-    asyncio.run(main())
+        application.run_polling()
 
 if __name__ == "__main__":
     main()